@@ -29,6 +29,15 @@ import tempfile
 import sys
 import json
 import socket
+import signal
+import selectors
+import logging
+import re
+import ast
+import runpy
+import importlib
+import threading
+from multiprocessing.reduction import sendfds, recvfds
 from distutils.util import strtobool
 import cfgmgr.config_manager as cfg
 from util.util import Util
@@ -47,6 +56,352 @@ FAILURE = -1
 KAPACITOR_PORT = 9092
 KAPACITOR_NAME = 'kapacitord'
 CONFIG_KEY_PATH = 'config'
+DEFAULT_WORKERS = 1
+DEFAULT_DISPATCH = 'round_robin'
+DISPATCH_POLICIES = ('round_robin', 'least_loaded')
+# Command line argument starting this script as the UDF zygote
+ZYGOTE_ARG = '--udf-zygote'
+# Command line argument starting this script as the launcher of a process
+# based python UDF, used as the UDF prog in the Kapacitor config
+FORK_ARG = '--udf-fork'
+# UNIX socket on which the UDF zygote receives the launcher requests
+ZYGOTE_SOCKET = os.path.join(TEMP_KAPACITOR_DIR, "udf_zygote")
+UDF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "udfs")
+# Interval in seconds at which the zygote reaps the UDFs it forked
+ZYGOTE_REAP_INTERVAL = 1
+UDF_READY_INTERVAL = 0.1
+UDF_READY_TIMEOUT = 300
+# Flag of the listening sockets in /proc/net/unix
+SO_ACCEPTCON = 0x10000
+
+
+def read_proc_kb(pid, file_name, key):
+    """Read a kB value of the given key from /proc/<pid>/<file_name>,
+       returns 0 if it is not available
+    """
+    try:
+        with open("/proc/{}/{}".format(pid, file_name)) as fpd:
+            for line in fpd:
+                if line.startswith(key + ":"):
+                    return int(line.split()[1])
+    except (OSError, IOError, ValueError):
+        pass
+    return 0
+
+
+def listening_unix_sockets(pid):
+    """Paths of the UNIX sockets the process listens on, a socket based
+       UDF is ready once it listens on its socket
+    """
+    inodes = set()
+    fd_dir = "/proc/{}/fd".format(pid)
+    paths = []
+    try:
+        for fd_name in os.listdir(fd_dir):
+            try:
+                link = os.readlink(os.path.join(fd_dir, fd_name))
+            except OSError:
+                continue
+            if link.startswith("socket:["):
+                inodes.add(link[len("socket:["):-1])
+        with open("/proc/net/unix") as fpd:
+            next(fpd)
+            for line in fpd:
+                fields = line.split()
+                if len(fields) > 7 and fields[6] in inodes and \
+                        int(fields[3], 16) & SO_ACCEPTCON:
+                    paths.append(fields[7])
+    except (OSError, IOError, ValueError, StopIteration):
+        pass
+    return paths
+
+
+def udf_script(udf_name):
+    """Path of the python UDF script
+    """
+    return os.path.join(UDF_DIR, udf_name + ".py")
+
+
+def forked_udfs(kapacitor_conf):
+    """Names of the process based python UDFs the Kapacitor config starts
+       through the launcher
+    """
+    with open(kapacitor_conf) as fpd:
+        names = re.findall(r'"{}",\s*"(\w+)"'.format(FORK_ARG), fpd.read())
+    return sorted(set(names))
+
+
+def module_imports(script):
+    """Modules imported at the top level of the python script
+    """
+    with open(script) as fpd:
+        tree = ast.parse(fpd.read(), script)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and \
+                node.level == 0:
+            modules.append(node.module)
+    return modules
+
+
+class UdfZygote():
+    """UDF zygote imports the modules of the python UDFs once and forks
+       every python UDF from that warm process, so the UDFs skip the
+       import start-up cost and share the imported pages copy-on-write.
+       The zygote is a fresh interpreter so it inherits no state, like
+       the config manager client, of the startup process.
+
+       The socket based UDFs of the task config are forked on start-up.
+       The process based UDFs are started by Kapacitor through the
+       launcher (classifier_startup.py --udf-fork <udf_name>), which
+       hands its stdin, stdout and stderr over to the zygote on
+       ZYGOTE_SOCKET and waits for the UDF forked on them to exit.
+    """
+    def __init__(self, logger):
+        self.logger = logger
+        self._listener = None
+        self._selector = None
+        # Launcher connection of the UDFs forked on request, by pid
+        self._launchers = {}
+
+    def launch(self, udfs, forked, dev_mode):
+        """Start the zygote and the given python UDFs from it
+
+        :param udfs: list of (udf_name, udf_env) of the UDFs to start
+        :type udfs: list
+        :param forked: names of the UDFs started later by the launcher
+        :type forked: list
+        :param dev_mode: whether running in dev mode, for the zygote logs
+        :type dev_mode: bool
+        :return: pid of the zygote and pids of the started UDFs
+        """
+        read_fd, write_fd = os.pipe()
+        try:
+            # Unbuffered like the "python3 -u" of the Kapacitor UDF config,
+            # the forked UDFs keep the zygote's standard streams
+            proc = subprocess.Popen([sys.executable, "-u",
+                                     os.path.abspath(__file__),
+                                     ZYGOTE_ARG, str(write_fd)],
+                                    stdin=subprocess.PIPE,
+                                    pass_fds=(write_fd,))
+        finally:
+            os.close(write_fd)
+        proc.stdin.write(json.dumps({"udfs": udfs,
+                                     "forked": forked,
+                                     "dev_mode": dev_mode}).encode())
+        proc.stdin.close()
+        with os.fdopen(read_fd) as pipe:
+            data = pipe.read()
+        return proc.pid, json.loads(data) if data else []
+
+    def preload(self, udf_names):
+        """Import the modules imported at the top level of the UDFs,
+           sklearn is patched by sklearnex before it is imported
+        """
+        start = time.time()
+        sys.path.insert(0, UDF_DIR)
+        modules = []
+        for udf_name in udf_names:
+            for module in module_imports(udf_script(udf_name)):
+                if module not in modules:
+                    modules.append(module)
+        if "sklearnex" in modules:
+            try:
+                from sklearnex import patch_sklearn
+                patch_sklearn()
+            except ImportError as err:
+                self.logger.warning("UDF zygote could not patch sklearn: "
+                                    "{}".format(err))
+        for module in modules:
+            try:
+                importlib.import_module(module)
+            except ImportError as err:
+                self.logger.warning("UDF zygote could not preload {}: "
+                                    "{}".format(module, err))
+        self.logger.info("UDF zygote preloaded {} in {:.2f}s".format(
+            modules, time.time() - start))
+
+    def serve(self, udfs, forked, reply_fd):
+        """Zygote process: preload, fork the UDFs, reply their pids on
+           reply_fd, then fork the UDFs requested by the launchers and
+           reap them
+        """
+        self.preload([udf_name for udf_name, _ in udfs] + forked)
+        pids = [self._fork(udf_name, udf_env, [reply_fd])
+                for udf_name, udf_env in udfs]
+
+        if os.path.exists(ZYGOTE_SOCKET):
+            os.remove(ZYGOTE_SOCKET)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(ZYGOTE_SOCKET)
+        self._listener.listen(16)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        with os.fdopen(reply_fd, 'w') as pipe:
+            json.dump(pids, pipe)
+
+        while True:
+            for key, _ in self._selector.select(ZYGOTE_REAP_INTERVAL):
+                if key.fileobj is self._listener:
+                    self._accept()
+                else:
+                    # The launcher has gone away, its UDF keeps running
+                    self._selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                    self._launchers[key.data] = None
+            self._reap()
+
+    def _accept(self):
+        """Fork the UDF requested by a launcher on the launcher's standard
+           streams
+        """
+        conn, _ = self._listener.accept()
+        fds = []
+        try:
+            conn.settimeout(ZYGOTE_REAP_INTERVAL)
+            fds = recvfds(conn, 3)
+            with conn.makefile('rb') as request_file:
+                request = json.loads(request_file.readline().decode())
+            start = time.time()
+            pid = self._fork(request["udf"], request["env"], [conn.fileno()],
+                             fds, request["args"])
+            self.logger.info("UDF zygote forked {} for its launcher in "
+                             "{:.1f} ms".format(request["udf"],
+                                                (time.time() - start) * 1e3))
+            conn.sendall("{}\n".format(pid).encode())
+            conn.settimeout(None)
+            self._selector.register(conn, selectors.EVENT_READ, pid)
+            self._launchers[pid] = conn
+        except (OSError, ValueError, KeyError) as err:
+            self.logger.error("UDF zygote failed to serve a launcher: "
+                              "{}".format(err))
+            conn.close()
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def _reap(self):
+        """Reap the exited UDFs and report their exit code to their
+           launcher
+        """
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if os.WIFSIGNALED(status):
+                code = 128 + os.WTERMSIG(status)
+            else:
+                code = os.WEXITSTATUS(status)
+            self.logger.info("UDF pid {} exited with status {}".format(
+                pid, code))
+            conn = self._launchers.pop(pid, None)
+            if conn is not None:
+                self._selector.unregister(conn)
+                try:
+                    conn.sendall("{}\n".format(code).encode())
+                except OSError:
+                    pass
+                conn.close()
+
+    def _fork(self, udf_name, udf_env, close_fds, stdio=None, args=()):
+        """Fork the UDF, its standard streams are replaced by stdio if
+           given
+        """
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid != 0:
+            self.logger.info("UDF zygote forked {} pid {}".format(udf_name,
+                                                                  pid))
+            return pid
+        # UDF process, it must not touch the zygote's descriptors
+        for fd in close_fds:
+            os.close(fd)
+        if self._listener is not None:
+            self._listener.close()
+            self._selector.close()
+            for conn in self._launchers.values():
+                if conn is not None:
+                    conn.close()
+        if stdio:
+            for target, fd in enumerate(stdio):
+                os.dup2(fd, target)
+                os.close(fd)
+        self._run_udf(udf_name, udf_env, args)
+
+    def _run_udf(self, udf_name, udf_env, args):
+        """UDF process: run the UDF script as __main__
+        """
+        status = SUCCESS
+        script = udf_script(udf_name)
+        try:
+            # The zygote's log handlers may write to stdout, which is the
+            # Kapacitor protocol stream of a process based UDF
+            logging.getLogger().handlers = []
+            self.logger.handlers = []
+            os.environ.clear()
+            os.environ.update(udf_env)
+            sys.argv = [script] + list(args)
+            runpy.run_path(script, run_name='__main__')
+        except SystemExit as err:
+            status = err.code if isinstance(err.code, int) else FAILURE
+        except Exception as err:
+            self.logger.exception("UDF {} failed: {}".format(udf_name, err))
+            status = FAILURE
+        finally:
+            sys.stdout.flush()
+            os._exit(status)
+
+
+def zygote_main():
+    """Main of the UDF zygote, the request is read from stdin
+    """
+    reply_fd = int(sys.argv[2])
+    request = json.load(sys.stdin)
+    logger = configure_logging(os.getenv('PY_LOG_LEVEL', 'info').upper(),
+                               __name__, request["dev_mode"])
+    UdfZygote(logger).serve(request["udfs"], request["forked"], reply_fd)
+
+
+def fork_main():
+    """Main of the launcher of a process based python UDF. The UDF is
+       forked by the zygote on the launcher's standard streams, or run
+       here when the zygote is not enabled.
+    """
+    udf_name = sys.argv[2]
+    args = sys.argv[3:]
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(ZYGOTE_SOCKET)
+    except OSError:
+        sock.close()
+        script = udf_script(udf_name)
+        os.execv(sys.executable, [sys.executable, "-u", script] + args)
+
+    sendfds(sock, [0, 1, 2])
+    # The request is a single line, the connection stays open so the
+    # zygote can tell the exit of the UDF
+    sock.sendall((json.dumps({"udf": udf_name, "env": dict(os.environ),
+                              "args": args}) + "\n").encode())
+    reply = sock.makefile('r')
+    pid = int(reply.readline())
+
+    def forward(signum, frame):
+        os.kill(pid, signum)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    code = reply.readline()
+    if not code:
+        # The zygote has gone away, do not leave the UDF behind
+        os.kill(pid, signal.SIGTERM)
+        sys.exit(FAILURE)
+    sys.exit(int(code))
 
 
 class KapacitorClassifier():
@@ -55,21 +410,38 @@ class KapacitorClassifier():
     """
     def __init__(self, logger):
         self.logger = logger
+        self.python_udf_pids = []
+
+    def udf_env(self, workers, dispatch):
+        """Environment of a python UDF process
+        """
+        udf_env = os.environ.copy()
+        udf_env["UDF_WORKERS"] = str(workers)
+        udf_env["UDF_DISPATCH"] = dispatch
+        return udf_env
 
-    def start_classifier(self, udf_type, udf_name):
+    def start_classifier(self, udf_type, udf_name, workers=DEFAULT_WORKERS,
+                         dispatch=DEFAULT_DISPATCH):
         """Starts the classifier module
         """
         try:
             if udf_type == "go":
                 self.logger.info("Running Go based UDF ... {0}".format(
                     udf_name))
+                if workers != DEFAULT_WORKERS:
+                    self.logger.info("workers is applicable only to python "
+                                     "UDFs, ignoring it for {}".format(
+                                         udf_name))
                 subprocess.Popen(["go", "run", "./udfs/" + udf_name + ".go",
                                   "&"])
             elif udf_type == "python":
-                self.logger.info("Running Python based UDF ... {}".format(
-                    udf_name))
-                subprocess.Popen(["python3.7", "./udfs/" + udf_name + ".py",
-                                  "&"])
+                self.logger.info("Running Python based UDF ... {} with {} "
+                                 "worker(s)".format(udf_name, workers))
+                # Same interpreter as the UDFs forked by the UDF zygote
+                proc = subprocess.Popen([sys.executable,
+                                         udf_script(udf_name), "&"],
+                                        env=self.udf_env(workers, dispatch))
+                self.python_udf_pids.append(proc.pid)
             else:
                 self.logger.error("Not a compatible type, please select "
                                   "either go or python")
@@ -232,7 +604,7 @@ class KapacitorClassifier():
             time.sleep(0.0001)
             retry = retry + 1
 
-    def start_udfs(self, config):
+    def start_udfs(self, config, dev_mode=False):
         """Starting the udf based on the config
            read from the etcd
         """
@@ -242,6 +614,9 @@ class KapacitorClassifier():
             error_msg = "task key is missing in config, EXITING!!!"
             return error_msg, FAILURE
 
+        use_zygote = config.get('udf_zygote', False)
+        zygote_udfs = []
+        started = time.time()
         for task in config['task']:
             if 'udfs' in task.keys():
                 for udf in task['udfs']:
@@ -260,7 +635,30 @@ class KapacitorClassifier():
                                      "EXITING!!!")
                         return error_msg, FAILURE
 
-                    if self.start_classifier(udf_type, udf_name) is True:
+                    workers = udf.get('workers', DEFAULT_WORKERS)
+                    if isinstance(workers, bool) or \
+                            not isinstance(workers, int) or workers < 1:
+                        error_msg = ("UDF workers should be a positive "
+                                     "integer EXITING!!!")
+                        return error_msg, FAILURE
+
+                    dispatch = udf.get('dispatch', DEFAULT_DISPATCH)
+                    if not isinstance(dispatch, str) or \
+                            dispatch.lower() not in DISPATCH_POLICIES:
+                        error_msg = ("UDF dispatch should be either "
+                                     "round_robin or least_loaded "
+                                     "EXITING!!!")
+                        return error_msg, FAILURE
+                    dispatch = dispatch.lower()
+
+                    if use_zygote and udf_type == "python":
+                        self.logger.info("Python based UDF {} will be forked "
+                                         "from the UDF zygote".format(
+                                             udf_name))
+                        zygote_udfs.append((udf_name,
+                                            self.udf_env(workers, dispatch)))
+                    elif self.start_classifier(udf_type, udf_name, workers,
+                                               dispatch) is True:
                         self.logger.info("Classifier started successfully")
                     else:
                         error_msg = ("Classifier is not able to start. "
@@ -269,8 +667,60 @@ class KapacitorClassifier():
             else:
                 self.logger.info("Configured task has no UDF")
 
+        zygote_pids = []
+        if use_zygote:
+            kapacitor_conf = 'config/' + (KAPACITOR_DEV if dev_mode
+                                          else KAPACITOR_PROD)
+            forked = forked_udfs(kapacitor_conf)
+            self.logger.info("Process based python UDFs {} will be forked "
+                             "from the UDF zygote".format(forked))
+            zygote = UdfZygote(self.logger)
+            zygote_pid, self.python_udf_pids = zygote.launch(zygote_udfs,
+                                                             forked,
+                                                             dev_mode)
+            zygote_pids.append(zygote_pid)
+            if len(self.python_udf_pids) != len(zygote_udfs):
+                error_msg = ("UDF zygote is not able to start the python "
+                             "UDFs. Fix all the Errors & try again")
+                return error_msg, FAILURE
+
+        if self.python_udf_pids:
+            mode = "with" if use_zygote else "without"
+            threading.Thread(target=self.report_udf_footprint,
+                             args=(self.python_udf_pids, zygote_pids,
+                                   started, mode),
+                             daemon=True).start()
+
         return None, SUCCESS
 
+    def report_udf_footprint(self, pids, zygote_pids, started, mode):
+        """Log the start-up time and the combined memory of the socket
+           based python UDFs. A UDF has started once it listens on its
+           socket. The memory includes the zygote, which holds the pages
+           shared by the UDFs. RSS counts the shared pages in every
+           process, PSS splits them between the sharing processes.
+        """
+        pending = set(pids)
+        while pending and time.time() - started < UDF_READY_TIMEOUT:
+            pending = set(pid for pid in pending
+                          if os.path.exists("/proc/{}".format(pid)) and
+                          not listening_unix_sockets(pid))
+            if pending:
+                time.sleep(UDF_READY_INTERVAL)
+        startup_time = time.time() - started
+        if pending:
+            self.logger.warning("Python UDF(s) {} not listening after "
+                                "{}s".format(sorted(pending),
+                                             UDF_READY_TIMEOUT))
+        measured = list(pids) + list(zygote_pids)
+        rss = sum(read_proc_kb(pid, "status", "VmRSS") for pid in measured)
+        pss = sum(read_proc_kb(pid, "smaps_rollup", "Pss")
+                  for pid in measured)
+        self.logger.info("Started {} python UDF(s) {} the UDF zygote in "
+                         "{:.2f}s, combined RSS: {} kB, combined PSS: {} "
+                         "kB".format(len(pids), mode, startup_time, rss,
+                                     pss))
+
     def enable_tasks(self, config, kapacitor_started, host_name, dev_mode):
         """Starting the task based on the config
            read from the etcd
@@ -338,7 +788,7 @@ def main():
                      'So exiting...')
         kapacitor_classifier.exit_with_failure_message(error_log)
 
-    msg, status = kapacitor_classifier.start_udfs(config)
+    msg, status = kapacitor_classifier.start_udfs(config, dev_mode)
     if status is FAILURE:
         kapacitor_classifier.exit_with_failure_message(msg)
 
@@ -361,4 +811,9 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 2 and sys.argv[1] == ZYGOTE_ARG:
+        zygote_main()
+    elif len(sys.argv) > 2 and sys.argv[1] == FORK_ARG:
+        fork_main()
+    else:
+        main()
@@ -23,7 +23,12 @@ SOFTWARE.
 package kapacitor
 
 import (
+    "sync"
+    "time"
+
     "github.com/influxdata/kapacitor/edge"
+    "github.com/influxdata/kapacitor/expvar"
+    "github.com/influxdata/kapacitor/models"
     "github.com/influxdata/kapacitor/pipeline"
     "github.com/golang/glog"
     eiicfgmgr "github.com/open-edge-insights/eii-configmgr-go/eiiconfigmgr"
@@ -38,8 +43,30 @@ type EiiOutNode struct {
     publisher *eiimsgbus.Publisher
     client *eiimsgbus.MsgbusClient
     batchBuffer *edge.BatchBuffer
+
+    // Points waiting to be published as one message when batching
+    mu sync.Mutex
+    pending []interface{}
+    pendingName string
+    timer *time.Timer
+    // Incremented on every flush so a late maxDelay timer is ignored
+    generation int64
+
+    messagesPublished *expvar.Int
+    pointsPublished *expvar.Int
+    publishErrors *expvar.Int
+    lastBatchSize *expvar.Int
+    publishLatency *expvar.Int
 }
 
+const (
+    statsEiiMessagesPublished = "messages_published"
+    statsEiiPointsPublished = "points_published"
+    statsEiiPublishErrors = "publish_errors"
+    statsEiiLastBatchSize = "last_batch_size"
+    statsEiiPublishLatency = "publish_latency_us"
+)
+
 func newEiiOutNode(et *ExecutingTask, n *pipeline.EiiOutNode, d NodeDiagnostic) (*EiiOutNode, error) {
     h := &EiiOutNode{
         // pass in necessary fields to the 'node' struct
@@ -47,6 +74,11 @@ func newEiiOutNode(et *ExecutingTask, n *pipeline.EiiOutNode, d NodeDiagnostic)
         // Keep a reference to the pipeline.HouseDBOutNode
         h: n,
         batchBuffer: new(edge.BatchBuffer),
+        messagesPublished: &expvar.Int{},
+        pointsPublished: &expvar.Int{},
+        publishErrors: &expvar.Int{},
+        lastBatchSize: &expvar.Int{},
+        publishLatency: &expvar.Int{},
     }
     // Set the function to be called when running the node
     // more on this in a bit.
@@ -56,6 +88,11 @@ func newEiiOutNode(et *ExecutingTask, n *pipeline.EiiOutNode, d NodeDiagnostic)
 }
 
 func (h *EiiOutNode) runOut(snapshot []byte) error {
+    h.statMap.Set(statsEiiMessagesPublished, h.messagesPublished)
+    h.statMap.Set(statsEiiPointsPublished, h.pointsPublished)
+    h.statMap.Set(statsEiiPublishErrors, h.publishErrors)
+    h.statMap.Set(statsEiiLastBatchSize, h.lastBatchSize)
+    h.statMap.Set(statsEiiPublishLatency, h.publishLatency)
     consumer := edge.NewConsumerWithReceiver(
         h.ins[0],
         h,
@@ -73,10 +110,16 @@ func (h *EiiOutNode) BatchPoint(bp edge.BatchPointMessage) (error) {
 
 func (h *EiiOutNode) EndBatch(end edge.EndBatchMessage) (error) {
     msg := h.batchBuffer.BufferedBatchMessage(end)
+    if h.batching() {
+        return h.writeBatch(msg)
+    }
     return h.write(msg)
 }
 
 func (h *EiiOutNode) Point(p edge.PointMessage) (error) {
+    if h.batching() {
+        return h.bufferPoint(p.Name(), p.Fields())
+    }
     batch := edge.NewBufferedBatchMessage(
         edge.NewBeginBatchMessage(
             p.Name(),
@@ -106,6 +149,11 @@ func (h *EiiOutNode) DeleteGroup(d edge.DeleteGroupMessage) (error) {
 }
 
 func (h *EiiOutNode) Done() {
+    h.mu.Lock()
+    if err := h.flush(); err != nil {
+        glog.Errorf("Error: publishing pending points: %v\n", err)
+    }
+    h.mu.Unlock()
     if h.publisher != nil  {
         h.publisher.Close()
     }
@@ -114,14 +162,12 @@ func (h *EiiOutNode) Done() {
     }
 }
 
-// Write a batch of data to HouseDB
-func (h *EiiOutNode) write(batch edge.BufferedBatchMessage) error {
-    // Implement writing to HouseDB here...
-    point := batch.Points()[0]
+// Convert the point fields to a message, int64 values are published as int
+func messageFields(pointFields models.Fields) map[string]interface{} {
     var ivalue interface{}
     var cvalue interface{}
     fields := make(map[string]interface{})
-    for key, value  := range  point.Fields(){
+    for key, value  := range  pointFields {
         ivalue = value
         switch ivalue.(type) {
         case int64:
@@ -132,13 +178,118 @@ func (h *EiiOutNode) write(batch edge.BufferedBatchMessage) error {
         }
         fields[key] = cvalue
     }
+    return fields
+}
+
+// Write a batch of data to HouseDB
+func (h *EiiOutNode) write(batch edge.BufferedBatchMessage) error {
+    // Implement writing to HouseDB here...
+    point := batch.Points()[0]
+    return h.publish(messageFields(point.Fields()), 1)
+}
+
+// Publish the message and update the publish statistics
+func (h *EiiOutNode) publish(msg map[string]interface{}, points int) error {
+    if h.publisher == nil {
+        return nil
+    }
+    start := time.Now()
+    err := h.publisher.Publish(msg)
+    h.publishLatency.Set(int64(time.Since(start) / time.Microsecond))
+    if err != nil {
+        h.publishErrors.Add(1)
+        glog.Errorf("Error: publishing message: %v\n", err)
+        return nil
+    }
+    h.messagesPublished.Add(1)
+    h.pointsPublished.Add(int64(points))
+    h.lastBatchSize.Set(int64(points))
+    return nil
+}
 
-    if h.publisher != nil {
-        h.publisher.Publish(fields)
+// Whether points are published in batches, see maxPoints and maxDelay
+func (h *EiiOutNode) batching() bool {
+    return h.h.MaxPoints > 1 || h.h.MaxDelay > 0
+}
+
+// Add a stream point to the pending batch and publish the batch once it
+// is full. The first point of a batch starts the maxDelay timer.
+func (h *EiiOutNode) bufferPoint(name string, fields models.Fields) error {
+    h.mu.Lock()
+    defer h.mu.Unlock()
+    // A message carries the points of a single measurement
+    if len(h.pending) > 0 && name != h.pendingName {
+        if err := h.flush(); err != nil {
+            return err
+        }
+    }
+    h.pendingName = name
+    h.pending = append(h.pending, messageFields(fields))
+    if h.h.MaxPoints > 0 && int64(len(h.pending)) >= h.h.MaxPoints {
+        return h.flush()
+    }
+    if len(h.pending) == 1 && h.h.MaxDelay > 0 {
+        generation := h.generation
+        h.timer = time.AfterFunc(h.h.MaxDelay, func() {
+            h.mu.Lock()
+            defer h.mu.Unlock()
+            if h.generation == generation {
+                h.flush()
+            }
+        })
     }
     return nil
 }
 
+// Publish a Kapacitor batch, after the pending stream points so that the
+// publish order is kept. The batch is split in messages of at most maxPoints
+// points, a message never carries points of two batches.
+func (h *EiiOutNode) writeBatch(batch edge.BufferedBatchMessage) error {
+    h.mu.Lock()
+    defer h.mu.Unlock()
+    if err := h.flush(); err != nil {
+        return err
+    }
+    name := batch.Begin().Name()
+    points := make([]interface{}, 0, len(batch.Points()))
+    for _, point := range batch.Points() {
+        points = append(points, messageFields(point.Fields()))
+        if h.h.MaxPoints > 0 && int64(len(points)) >= h.h.MaxPoints {
+            if err := h.publish(envelope(name, points), len(points)); err != nil {
+                return err
+            }
+            points = make([]interface{}, 0, h.h.MaxPoints)
+        }
+    }
+    if len(points) == 0 {
+        return nil
+    }
+    return h.publish(envelope(name, points), len(points))
+}
+
+// The message carrying a batch of points of the measurement
+func envelope(name string, points []interface{}) map[string]interface{} {
+    return map[string]interface{}{
+        "name": name,
+        "points": points,
+    }
+}
+
+// Publish the pending points as one message. Must be called with h.mu held.
+func (h *EiiOutNode) flush() error {
+    if h.timer != nil {
+        h.timer.Stop()
+        h.timer = nil
+    }
+    h.generation++
+    if len(h.pending) == 0 {
+        return nil
+    }
+    points := h.pending
+    h.pending = nil
+    return h.publish(envelope(h.pendingName, points), len(points))
+}
+
 func (h *EiiOutNode) initPublisher() error {
     configmgr, err := eiicfgmgr.ConfigManager()
     if err != nil {
@@ -22,6 +22,11 @@ SOFTWARE.
 
 package pipeline
 
+import (
+    "fmt"
+    "time"
+)
+
 // Writes the data to EII Message Bus as it is received.
 //
 // Example:
@@ -36,6 +41,22 @@ package pipeline
 //               .pubname('eisOutNode')
 //               .topic('publish_test')
 //
+// Points can be published in batches, one message {"name", "points"}
+// carrying an array of points of a measurement, by setting maxPoints and/or
+// maxDelay. A batch is published when it holds maxPoints points or when its
+// oldest point has waited maxDelay. On a stream edge maxDelay is required
+// when maxPoints is greater than 1, else the last points of a slow stream
+// would wait until the task stops. Kapacitor batches of a batch edge are
+// published as soon as they end, split in messages of at most maxPoints
+// points; a message never carries points of two Kapacitor batches.
+//
+// Example:
+//        |eiiOut()
+//               .pubname('eiiOutNode')
+//               .topic('publish_test')
+//               .maxPoints(100)
+//               .maxDelay(10ms)
+//
 
 type EiiOutNode struct {
    // Include the generic node implementation.
@@ -44,6 +65,12 @@ type EiiOutNode struct {
    Pubname string `json:"pubname"`
    // EII publisher topic
    Topic string `json:"topic"`
+   // Maximum number of points published in one message.
+   // 0 publishes every point on its own unless maxDelay is set.
+   MaxPoints int64 `json:"maxPoints"`
+   // Maximum time a point waits for its batch to be published.
+   // Required on a stream edge when maxPoints is greater than 1.
+   MaxDelay time.Duration `json:"maxDelay"`
 }
 
 // Create a new EiiOutNode that accepts any edge type.
@@ -57,3 +84,17 @@ func newEiiOutNode(wants EdgeType) *EiiOutNode{
     }
 }
 
+func (n *EiiOutNode) validate() error {
+    if n.MaxPoints < 0 {
+        return fmt.Errorf("maxPoints must not be negative")
+    }
+    if n.MaxDelay < 0 {
+        return fmt.Errorf("maxDelay must not be negative")
+    }
+    if n.wants == StreamEdge && n.MaxPoints > 1 && n.MaxDelay == 0 {
+        return fmt.Errorf("maxDelay must be set when maxPoints is greater " +
+            "than 1, else the last points are published only when the " +
+            "task stops")
+    }
+    return nil
+}
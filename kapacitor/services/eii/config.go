@@ -23,6 +23,7 @@ SOFTWARE.
 package eii
 
 import (
+	"fmt"
 	"time"
 	"github.com/influxdata/influxdb/toml"
 )
@@ -43,26 +44,55 @@ const (
 	// DefaultBatchDuration is the default batch timeout duration.
 	DefaultBatchDuration = toml.Duration(10 * time.Second)
 
+	// DefaultConverterWorkers is the default number of goroutines converting
+	// received messages to points. More than one gives up the point order.
+	DefaultConverterWorkers = 1
+
+	// DefaultWriteWorkers is the default number of goroutines writing point
+	// batches to the storage. More than one gives up the point order.
+	DefaultWriteWorkers = 1
+
+	// DefaultQueueDepth is the default number of received messages waiting
+	// for conversion.
+	DefaultQueueDepth = 10000
+
+	// QueuePolicyBlock makes the subscribers wait when the queue is full.
+	QueuePolicyBlock = "block"
+
+	// QueuePolicyDrop makes the subscribers drop messages when the queue
+	// is full.
+	QueuePolicyDrop = "drop"
+
+	// DefaultQueuePolicy is the default queue full policy.
+	DefaultQueuePolicy = QueuePolicyBlock
 )
 
 // Config represents a configuration for the collectd service.
 type Config struct {
-	Enabled         bool          `toml:"enabled"`
-	Database        string        `toml:"database"`
-	RetentionPolicy string        `toml:"retention-policy"`
-	BatchSize       int           `toml:"batch-size"`
-	BatchPending    int           `toml:"batch-pending"`
-	BatchDuration   toml.Duration `toml:"batch-timeout"`
+	Enabled          bool          `toml:"enabled"`
+	Database         string        `toml:"database"`
+	RetentionPolicy  string        `toml:"retention-policy"`
+	BatchSize        int           `toml:"batch-size"`
+	BatchPending     int           `toml:"batch-pending"`
+	BatchDuration    toml.Duration `toml:"batch-timeout"`
+	ConverterWorkers int           `toml:"converter-workers"`
+	WriteWorkers     int           `toml:"write-workers"`
+	QueueDepth       int           `toml:"queue-depth"`
+	QueuePolicy      string        `toml:"queue-full-policy"`
 }
 
 // NewConfig returns a new instance of Config with defaults.
 func NewConfig() Config {
 	return Config{
-		Database:        DefaultDatabase,
-		RetentionPolicy: DefaultRetentionPolicy,
-		BatchSize:       DefaultBatchSize,
-		BatchPending:    DefaultBatchPending,
-		BatchDuration:   DefaultBatchDuration,
+		Database:         DefaultDatabase,
+		RetentionPolicy:  DefaultRetentionPolicy,
+		BatchSize:        DefaultBatchSize,
+		BatchPending:     DefaultBatchPending,
+		BatchDuration:    DefaultBatchDuration,
+		ConverterWorkers: DefaultConverterWorkers,
+		WriteWorkers:     DefaultWriteWorkers,
+		QueueDepth:       DefaultQueueDepth,
+		QueuePolicy:      DefaultQueuePolicy,
 	}
 }
 
@@ -85,6 +115,38 @@ func (c *Config) WithDefaults() *Config {
 	if d.BatchDuration == 0 {
 		d.BatchDuration = DefaultBatchDuration
 	}
+	if d.ConverterWorkers == 0 {
+		d.ConverterWorkers = DefaultConverterWorkers
+	}
+	if d.WriteWorkers == 0 {
+		d.WriteWorkers = DefaultWriteWorkers
+	}
+	if d.QueueDepth == 0 {
+		d.QueueDepth = DefaultQueueDepth
+	}
+	if d.QueuePolicy == "" {
+		d.QueuePolicy = DefaultQueuePolicy
+	}
 
 	return &d
 }
+
+// Validate returns an error if the config is invalid.
+func (c *Config) Validate() error {
+	if c.ConverterWorkers < 0 {
+		return fmt.Errorf("converter-workers must not be negative")
+	}
+	if c.WriteWorkers < 0 {
+		return fmt.Errorf("write-workers must not be negative")
+	}
+	if c.QueueDepth < 0 {
+		return fmt.Errorf("queue-depth must not be negative")
+	}
+	switch c.QueuePolicy {
+	case "", QueuePolicyBlock, QueuePolicyDrop:
+	default:
+		return fmt.Errorf("invalid queue-full-policy %q, must be %q or %q",
+			c.QueuePolicy, QueuePolicyBlock, QueuePolicyDrop)
+	}
+	return nil
+}
@@ -47,8 +47,20 @@ const (
     statPointsTransmitted    = "pointsTx"
     statBatchesTransmitFail  = "batchesTxFail"
     statDroppedPointsInvalid = "droppedPointsInvalid"
+    statDroppedQueueFull     = "droppedMessagesQueueFull"
+    statQueueDepth           = "queueDepth"
+    statQueueCapacity        = "queueCapacity"
+    statLastBatchSize        = "lastBatchSize"
+    statMaxBatchSize         = "maxBatchSize"
 )
 
+// A received message queued along with its arrival time, used as the
+// timestamp of the point
+type receivedMsg struct {
+    msg      *types.MsgEnvelope
+    received time.Time
+}
+
 // pointsWriter is an internal interface to make testing easier.
 type pointsWriter interface {
     WritePoints(database,
@@ -72,6 +84,8 @@ type Service struct {
     // Waitgroup for handleSubscriber() thread
     wgs         sync.WaitGroup
     batcher     *tsdb.PointBatcher
+    // Received messages waiting for the converter goroutines
+    msgs        chan receivedMsg
     mu          sync.RWMutex
     // Mutex to synchronize handleSubscriber() thread
     mus         sync.RWMutex
@@ -112,6 +126,8 @@ func (s *Service) Open() error {
         return fmt.Errorf("storage name is blank")
     } else if s.PointsWriter == nil {
         return fmt.Errorf("PointsWriter is nil")
+    } else if err := s.Config.Validate(); err != nil {
+        return err
     }
 
 
@@ -121,11 +137,22 @@ func (s *Service) Open() error {
                                     time.Duration(s.Config.BatchDuration))
     s.batcher.Start()
 
+    s.msgs = make(chan receivedMsg, s.Config.QueueDepth)
+
     // Create waitgroup for signalling goroutines to stop and start goroutines
-    // that process data from eii.
-    s.wg.Add(2)
+    // that process data from eii: the subscribers queue the messages, the
+    // converters turn them into points for the batcher and the writers
+    // write the batches to the storage.
+    s.wg.Add(1 + s.Config.ConverterWorkers + s.Config.WriteWorkers)
     go func() { defer s.wg.Done(); s.serve() }()
-    go func() { defer s.wg.Done(); s.writePoints() }()
+    for i := 0; i < s.Config.ConverterWorkers; i++ {
+        go func() { defer s.wg.Done(); s.convertMessages() }()
+    }
+    for i := 0; i < s.Config.WriteWorkers; i++ {
+        go func() { defer s.wg.Done(); s.writePoints() }()
+    }
+    s.Logger.Printf("Ingest pipeline: %d converters, %d writers, queue depth %d, queue full policy %s",
+        s.Config.ConverterWorkers, s.Config.WriteWorkers, s.Config.QueueDepth, s.Config.QueuePolicy)
 
     return nil
 }
@@ -196,10 +223,16 @@ type Statistics struct {
     PointsTransmitted    int64
     BatchesTransmitFail  int64
     InvalidDroppedPoints int64
+    QueueFullDropped     int64
+    LastBatchSize        int64
+    MaxBatchSize         int64
 }
 
 // Statistics returns statistics for periodic monitoring.
 func (s *Service) Statistics(tags map[string]string) []models.Statistic {
+    s.mu.RLock()
+    msgs := s.msgs
+    s.mu.RUnlock()
     return []models.Statistic{{
         Name: "eii",
         Tags: s.defaultTags.Merge(tags),
@@ -210,6 +243,11 @@ func (s *Service) Statistics(tags map[string]string) []models.Statistic {
             statPointsTransmitted:      atomic.LoadInt64(&s.stats.PointsTransmitted),
             statBatchesTransmitFail:    atomic.LoadInt64(&s.stats.BatchesTransmitFail),
             statDroppedPointsInvalid:   atomic.LoadInt64(&s.stats.InvalidDroppedPoints),
+            statDroppedQueueFull:       atomic.LoadInt64(&s.stats.QueueFullDropped),
+            statQueueDepth:             int64(len(msgs)),
+            statQueueCapacity:          int64(cap(msgs)),
+            statLastBatchSize:          atomic.LoadInt64(&s.stats.LastBatchSize),
+            statMaxBatchSize:           atomic.LoadInt64(&s.stats.MaxBatchSize),
         },
     }}
 }
@@ -224,7 +262,7 @@ func handleSubscriber(sub *eiimsgbus.Subscriber, service *Service) {
             // We closed the connection, time to go.
             return
         case msg := <-sub.MessageChannel:
-            service.handleMessage(msg)
+            service.enqueueMessage(msg)
         case err := <-sub.ErrorChannel:
             service.mus.Lock()
             atomic.AddInt64(&service.stats.ReadFail, 1)
@@ -310,11 +348,9 @@ func (s *Service) serve() {
 
 // Convert the received publisher data into Points data which can be wriiten
 // to the Kapacitor internal storage
-func (s *Service) convertMsgToPoints(msg *types.MsgEnvelope) models.Point {
+func (s *Service) convertMsgToPoints(msg *types.MsgEnvelope, timestamp time.Time) models.Point {
     tags := make(map[string]string)
 
-    timestamp :=  time.Now()
-
     point, err := models.NewPoint(msg.Name, models.NewTags(tags), msg.Data, timestamp)
     if (err != nil || point == nil) {
         // Drop invalid points
@@ -326,20 +362,64 @@ func (s *Service) convertMsgToPoints(msg *types.MsgEnvelope) models.Point {
     return point
 }
 
+// Queue the received message for the converters. When the queue is full the
+// message is either dropped or the subscriber waits, as per queue-full-policy
+func (s *Service) enqueueMessage(msg *types.MsgEnvelope) {
+    // Stamp the point on arrival so that the queueing delay is not part of it
+    rmsg := receivedMsg{msg: msg, received: time.Now()}
+    if s.Config.QueuePolicy == QueuePolicyDrop {
+        select {
+        case s.msgs <- rmsg:
+        default:
+            atomic.AddInt64(&s.stats.QueueFullDropped, 1)
+        }
+        return
+    }
+    select {
+    case s.msgs <- rmsg:
+    case <-s.done:
+    }
+}
+
+// The converter thread reading queued messages and sending the converted
+// points to the batcher. Several of them run in parallel.
+func (s *Service) convertMessages() {
+    for {
+        select {
+        case <-s.done:
+            return
+        case rmsg := <-s.msgs:
+            s.handleMessage(rmsg.msg, rmsg.received)
+        }
+    }
+}
+
 // Process the message and send the data to batcher
-func (s *Service) handleMessage(msg *types.MsgEnvelope) {
-    s.mus.Lock()
-    defer s.mus.Unlock()
-    point := s.convertMsgToPoints(msg)
+func (s *Service) handleMessage(msg *types.MsgEnvelope, received time.Time) {
+    point := s.convertMsgToPoints(msg, received)
     if point != nil {
-        s.batcher.In() <- point
-        atomic.AddInt64(&s.stats.PointsReceived, 1)
+        select {
+        case s.batcher.In() <- point:
+            atomic.AddInt64(&s.stats.PointsReceived, 1)
+        case <-s.done:
+        }
+    }
+}
+
+// Record the size of a batch handed to the storage
+func (s *Service) recordBatchSize(size int64) {
+    atomic.StoreInt64(&s.stats.LastBatchSize, size)
+    for {
+        max := atomic.LoadInt64(&s.stats.MaxBatchSize)
+        if size <= max || atomic.CompareAndSwapInt64(&s.stats.MaxBatchSize, max, size) {
+            return
+        }
     }
 }
 
 
 // The thread responsible for reading Points data from message channel and writing the same 
-// to the kapacitor internal storage
+// to the kapacitor internal storage. write-workers of them run in parallel
 func (s *Service) writePoints() {
     for {
         select {
@@ -352,6 +432,7 @@ func (s *Service) writePoints() {
                 continue
             }
 
+            s.recordBatchSize(int64(len(batch)))
             if err := s.PointsWriter.WritePoints(s.Config.Database, s.Config.RetentionPolicy, models.ConsistencyLevelAny, batch); err == nil {
                 atomic.AddInt64(&s.stats.BatchesTransmitted, 1)
                 atomic.AddInt64(&s.stats.PointsTransmitted, int64(len(batch)))
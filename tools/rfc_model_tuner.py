@@ -0,0 +1,216 @@
+# Copyright (c) 2021 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+""" Offline size/latency trade-off tool for the RFC UDF model.
+
+    Trains random forests over a grid of tree counts, depth limits and
+    cost-complexity pruning values on the RFC training set, measures the
+    test accuracy, the per-row prediction latency (one row at a time, as
+    the UDF predicts) and the serialized model size, prints the Pareto
+    frontier and exports the smallest model meeting the target accuracy
+    in the format loaded by rfc_classifier.py (RFC_MODEL_PATH).
+
+    Example:
+        python3 tools/rfc_model_tuner.py --target-accuracy 0.98 \\
+            --output training_data_sets/rfc_model.joblib
+"""
+
+import argparse
+import itertools
+import json
+import pickle
+import sys
+import time
+import joblib
+import pandas as pd
+# sklearn is imported within the functions, after main() had the chance to
+# patch it with sklearnex
+
+DEFAULT_TRAINING_SET = 'training_data_sets/Log_rf.csv'
+DEFAULT_TREES = '25,50,100,200,400,600'
+DEFAULT_DEPTHS = 'none,8,12,16'
+DEFAULT_CCP_ALPHAS = '0,0.001,0.005'
+
+
+def parse_list(value, cast):
+    """ Parse a comma separated list, 'none' is mapped to None
+    """
+    items = []
+    for item in value.split(','):
+        item = item.strip()
+        items.append(None if item.lower() == 'none' else cast(item))
+    return items
+
+
+def load_training_set(path):
+    """ Load and split the training set like RfcHandler does, shuffled with
+        a fixed seed so that the runs are comparable
+    """
+    from sklearn.model_selection import train_test_split
+    training = pd.read_csv(path)
+    training = training.sample(frac=1, random_state=20)
+    y = training.label
+    X = training.iloc[:, :-1]
+    return train_test_split(X, y, test_size=0.2, random_state=20,
+                            stratify=y)
+
+
+def row_latency_ms(model, X_test, rows):
+    """ Median latency in ms of predicting a single row
+    """
+    samples = []
+    for i in range(min(rows, len(X_test))):
+        row = X_test.iloc[i:i + 1]
+        start = time.perf_counter()
+        model.predict(row)
+        samples.append((time.perf_counter() - start) * 1e3)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def evaluate(params, data, latency_rows):
+    """ Train a forest with the given parameters and measure it
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.metrics import accuracy_score
+    X_train, X_test, y_train, y_test = data
+    n_estimators, max_depth, ccp_alpha = params
+    model = RandomForestClassifier(n_estimators=n_estimators,
+                                   max_depth=max_depth,
+                                   ccp_alpha=ccp_alpha,
+                                   random_state=20)
+    model.fit(X_train, y_train)
+    result = {
+        'n_estimators': n_estimators,
+        'max_depth': max_depth,
+        'ccp_alpha': ccp_alpha,
+        'accuracy': accuracy_score(y_test, model.predict(X_test)),
+        'latency_ms': row_latency_ms(model, X_test, latency_rows),
+        'size_bytes': len(pickle.dumps(model)),
+    }
+    return result, model
+
+
+def dominates(a, b):
+    """ True if result a is at least as good as b everywhere and better
+        somewhere
+    """
+    not_worse = (a['accuracy'] >= b['accuracy'] and
+                 a['latency_ms'] <= b['latency_ms'] and
+                 a['size_bytes'] <= b['size_bytes'])
+    better = (a['accuracy'] > b['accuracy'] or
+              a['latency_ms'] < b['latency_ms'] or
+              a['size_bytes'] < b['size_bytes'])
+    return not_worse and better
+
+
+def pareto_frontier(results):
+    """ Results not dominated by any other result
+    """
+    return [r for r in results
+            if not any(dominates(o, r) for o in results if o is not r)]
+
+
+def print_results(title, results):
+    print(title)
+    print("{:>6} {:>6} {:>8} {:>9} {:>11} {:>11}".format(
+        'trees', 'depth', 'ccp', 'accuracy', 'latency_ms', 'size_kb'))
+    for r in results:
+        print("{:>6} {:>6} {:>8} {:>9.4f} {:>11.3f} {:>11.1f}".format(
+            r['n_estimators'], str(r['max_depth']), r['ccp_alpha'],
+            r['accuracy'], r['latency_ms'], r['size_bytes'] / 1024))
+    print()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--data', default=DEFAULT_TRAINING_SET,
+                        help='training set csv (default: %(default)s)')
+    parser.add_argument('--trees', default=DEFAULT_TREES,
+                        help='tree counts to try (default: %(default)s)')
+    parser.add_argument('--depths', default=DEFAULT_DEPTHS,
+                        help='depth limits to try, none for unlimited '
+                             '(default: %(default)s)')
+    parser.add_argument('--ccp-alphas', default=DEFAULT_CCP_ALPHAS,
+                        help='pruning alphas to try (default: %(default)s)')
+    parser.add_argument('--latency-rows', type=int, default=200,
+                        help='rows used to measure the per-row latency '
+                             '(default: %(default)s)')
+    parser.add_argument('--target-accuracy', type=float, default=None,
+                        help='export the smallest model reaching this '
+                             'test accuracy')
+    parser.add_argument('--output', default='rfc_model.joblib',
+                        help='path of the exported model '
+                             '(default: %(default)s)')
+    parser.add_argument('--report', default=None,
+                        help='write all results as json to this path')
+    parser.add_argument('--no-sklearnex', action='store_true',
+                        help='do not patch sklearn with sklearnex, the RFC '
+                             'UDF patches it so keep it for real numbers')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.no_sklearnex:
+        from sklearnex import patch_sklearn
+        patch_sklearn()
+
+    data = load_training_set(args.data)
+    grid = itertools.product(parse_list(args.trees, int),
+                             parse_list(args.depths, int),
+                             parse_list(args.ccp_alphas, float))
+    results = []
+    best = None
+    for params in grid:
+        result, model = evaluate(params, data, args.latency_rows)
+        results.append(result)
+        print("trees={n_estimators} depth={max_depth} ccp={ccp_alpha} "
+              "accuracy={accuracy:.4f} latency={latency_ms:.3f}ms "
+              "size={size_bytes}B".format(**result), file=sys.stderr)
+        if (args.target_accuracy is not None and
+                result['accuracy'] >= args.target_accuracy and
+                (best is None or
+                 result['size_bytes'] < best[0]['size_bytes'])):
+            best = (result, model)
+
+    frontier = sorted(pareto_frontier(results),
+                      key=lambda r: r['size_bytes'])
+    print_results("Pareto frontier (accuracy / latency / size):", frontier)
+
+    if args.report:
+        with open(args.report, 'w') as fpd:
+            json.dump({'results': results, 'frontier': frontier}, fpd,
+                      indent=2)
+
+    if args.target_accuracy is None:
+        return 0
+    if best is None:
+        print("No model reached the target accuracy {}".format(
+            args.target_accuracy))
+        return 1
+
+    joblib.dump(best[1], args.output)
+    print_results("Exported to {}:".format(args.output), [best[0]])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+# Copyright (c) 2021 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+""" Per-group state table shared by the UDF handlers.
+
+    Kapacitor tags every point and batch with the ID of the group it
+    belongs to (point.group, begin_req.group, batch_meta.group). Handlers
+    that keep state between calls use this table to shard that state by
+    group ID, so points of different groups (e.g. different assets) are
+    never mixed and the memory used stays bounded as the number of groups
+    grows.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+# Default maximum number of groups kept in the table
+DEFAULT_MAX_GROUPS = 10000
+# Default idle time in seconds after which a group is evicted,
+# 0 disables the TTL based eviction
+DEFAULT_GROUP_TTL = 0
+
+
+class _GroupEntry(object):
+    """ State of a single group along with its last access time
+    """
+    __slots__ = ('state', 'last_access')
+
+    def __init__(self, state, last_access):
+        self.state = state
+        self.last_access = last_access
+
+
+class GroupStateTable(object):
+    """ Hash indexed table of per-group state with LRU and TTL eviction.
+
+        The table keeps at most `max_groups` entries. When a new group is
+        added to a full table the least recently used group is evicted.
+        Groups which are not accessed for `ttl` seconds are evicted as well.
+        `on_evict` is called with (group, state) for every evicted group so
+        the handler can flush any pending state.
+    """
+    def __init__(self, factory, max_groups=DEFAULT_MAX_GROUPS,
+                 ttl=DEFAULT_GROUP_TTL, on_evict=None):
+        """
+        :param factory: callable returning the initial state of a new group
+        :type factory: callable
+        :param max_groups: maximum number of groups kept in the table
+        :type max_groups: int
+        :param ttl: idle time in seconds after which a group is evicted,
+                    0 disables the TTL eviction
+        :type ttl: float
+        :param on_evict: callable invoked as on_evict(group, state) for
+                         every group evicted by the LRU or TTL policy
+        :type on_evict: callable
+        """
+        if max_groups <= 0:
+            raise ValueError("max_groups must be greater than 0")
+        if ttl < 0:
+            raise ValueError("ttl must not be negative")
+        self._factory = factory
+        self._max_groups = max_groups
+        self._ttl = ttl
+        self._on_evict = on_evict
+        self._groups = OrderedDict()
+        self._lock = threading.Lock()
+        self._lru_evictions = 0
+        self._ttl_evictions = 0
+        self._deletions = 0
+        self._created = 0
+
+    @classmethod
+    def from_env(cls, environ, factory, on_evict=None, prefix='UDF'):
+        """ Create the table with limits read from the environment.
+
+            <prefix>_MAX_GROUPS and <prefix>_GROUP_TTL override the
+            defaults, these can be set in the udf env section of the
+            kapacitor config.
+        """
+        max_groups = int(environ.get(prefix + '_MAX_GROUPS',
+                                     DEFAULT_MAX_GROUPS))
+        ttl = float(environ.get(prefix + '_GROUP_TTL', DEFAULT_GROUP_TTL))
+        return cls(factory, max_groups=max_groups, ttl=ttl,
+                   on_evict=on_evict)
+
+    @property
+    def ttl(self):
+        """ Idle time in seconds after which a group is evicted, 0 if the
+            TTL eviction is disabled
+        """
+        return self._ttl
+
+    def get(self, group):
+        """ Return the state of the group, creating it if not present
+
+        :param group: Kapacitor group ID
+        :type group: str
+        """
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            self._expire(now, evicted)
+            entry = self._groups.get(group)
+            if entry is None:
+                while len(self._groups) >= self._max_groups:
+                    evicted.append(self._groups.popitem(last=False))
+                    self._lru_evictions += 1
+                entry = _GroupEntry(self._factory(), now)
+                self._groups[group] = entry
+                self._created += 1
+            else:
+                entry.last_access = now
+                self._groups.move_to_end(group)
+        self._notify(evicted)
+        return entry.state
+
+    def delete(self, group):
+        """ Remove the group and return its state, None if not present.
+            To be called when Kapacitor is done with a group.
+        """
+        with self._lock:
+            entry = self._groups.pop(group, None)
+            if entry is not None:
+                self._deletions += 1
+        return None if entry is None else entry.state
+
+    def expire(self):
+        """ Evict the groups idle for longer than the TTL. get() does it as
+            well, call it periodically to evict the groups when no points
+            arrive.
+        """
+        evicted = []
+        with self._lock:
+            self._expire(time.monotonic(), evicted)
+        self._notify(evicted)
+
+    def _expire(self, now, evicted):
+        if not self._ttl:
+            return
+        # Entries are kept in access order so only the head can be stale
+        while self._groups:
+            group, entry = next(iter(self._groups.items()))
+            if now - entry.last_access < self._ttl:
+                break
+            del self._groups[group]
+            evicted.append((group, entry))
+            self._ttl_evictions += 1
+
+    def _notify(self, evicted):
+        if self._on_evict is None:
+            return
+        for group, entry in evicted:
+            self._on_evict(group, entry.state)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._groups)
+
+    def __contains__(self, group):
+        with self._lock:
+            return group in self._groups
+
+    def stats(self):
+        """ Return the occupancy and eviction counters of the table
+        """
+        with self._lock:
+            return {
+                'groups': len(self._groups),
+                'max_groups': self._max_groups,
+                'created': self._created,
+                'deleted': self._deletions,
+                'lru_evictions': self._lru_evictions,
+                'ttl_evictions': self._ttl_evictions,
+            }
@@ -0,0 +1,154 @@
+# Copyright (c) 2021 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+""" LRU cache of model predictions keyed by quantized feature vectors.
+
+    Sensors often report identical or nearly identical feature vectors for
+    long stretches. Every feature is mapped to the index k of the cell
+    [k * step, (k + 1) * step) of its step and the vector of indices is
+    used as the key, so the model is run only once for vectors falling
+    into the same cell.
+"""
+
+import json
+import math
+import threading
+from collections import OrderedDict
+
+
+class PredictionCache(object):
+    """ Bounded LRU memoization of model predictions.
+
+        The cache is bound to a model version with set_model() and is
+        cleared whenever the version changes.
+    """
+    def __init__(self, capacity, features, steps=None, default_step=0):
+        """
+        :param capacity: maximum number of cached predictions
+        :type capacity: int
+        :param features: names of the features, in vector order
+        :type features: list
+        :param steps: quantization step per feature name, features not
+                      present use default_step
+        :type steps: dict
+        :param default_step: quantization step of the other features,
+                             0 uses the exact value
+        :type default_step: float
+        """
+        if capacity <= 0:
+            raise ValueError("capacity must be greater than 0")
+        steps = steps or {}
+        unknown = set(steps) - set(features)
+        if unknown:
+            raise ValueError("unknown features in quantization: {}".format(
+                sorted(unknown)))
+        self._capacity = capacity
+        self._steps = [float(steps.get(name, default_step))
+                       for name in features]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._model_version = None
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+        self._inference_time = 0.0
+
+    @classmethod
+    def from_env(cls, environ, features, prefix='RFC'):
+        """ Create the cache configured by <prefix>_CACHE_SIZE and
+            <prefix>_CACHE_QUANTIZATION, None if the size is 0.
+
+            The quantization is either a single step for every feature or
+            a json object of per-feature steps, where the "default" key
+            sets the step of the features not listed.
+        """
+        capacity = int(environ.get(prefix + '_CACHE_SIZE', 0))
+        if capacity <= 0:
+            return None
+        quantization = environ.get(prefix + '_CACHE_QUANTIZATION', '0')
+        try:
+            return cls(capacity, features, default_step=float(quantization))
+        except ValueError:
+            pass
+        steps = json.loads(quantization)
+        default_step = steps.pop('default', 0)
+        return cls(capacity, features, steps=steps,
+                   default_step=default_step)
+
+    def set_model(self, version):
+        """ Bind the cache to the model version, the cached predictions
+            of another version are dropped
+        """
+        with self._lock:
+            if version == self._model_version:
+                return
+            if self._entries:
+                self._invalidations += 1
+            self._entries.clear()
+            self._model_version = version
+
+    def key(self, vector):
+        """ Return the cache key of the feature vector
+        """
+        return tuple(math.floor(value / step) if step else value
+                     for value, step in zip(vector, self._steps))
+
+    def get(self, key):
+        """ Return the cached prediction of the key, None on a miss
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def put(self, key, value, inference_time):
+        """ Cache the prediction of the key
+
+        :param inference_time: seconds the model took to predict it
+        :type inference_time: float
+        """
+        with self._lock:
+            self._inference_time += inference_time
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """ Return the hit/miss counters and the estimated inference time
+            saved by the hits, based on the mean time of the misses
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            mean_time = (self._inference_time / self._misses
+                         if self._misses else 0.0)
+            return {
+                'entries': len(self._entries),
+                'capacity': self._capacity,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': self._hits / lookups if lookups else 0.0,
+                'invalidations': self._invalidations,
+                'saved_inference_ms': self._hits * mean_time * 1e3,
+            }
@@ -0,0 +1,261 @@
+# Copyright (c) 2021 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+""" Pre-forked worker pool for the UNIX socket based python UDFs.
+
+    The master process accepts the Kapacitor task connections on the UDF
+    socket and hands every connection over to one of N worker processes,
+    so the tasks using the same UDF are spread over several interpreters
+    instead of sharing a single GIL. Dead workers are replaced.
+"""
+
+import os
+import signal
+import socket
+import logging
+import selectors
+import threading
+from multiprocessing.reduction import send_handle, recv_handle
+from kapacitor.udf.agent import Server
+
+logger = logging.getLogger()
+
+ROUND_ROBIN = "round_robin"
+LEAST_LOADED = "least_loaded"
+DISPATCH_POLICIES = (ROUND_ROBIN, LEAST_LOADED)
+# Byte sent by a worker to the master when a connection is finished
+_CONN_DONE = b'.'
+# Interval in seconds at which the master checks for dead workers
+_REAP_INTERVAL = 1
+
+
+class _Worker(object):
+    """ Master side bookkeeping of a worker process
+    """
+    def __init__(self, index, pid, channel):
+        self.index = index
+        self.pid = pid
+        self.channel = channel
+        self.active = 0
+
+
+class PreforkServer(object):
+    """ UDF socket server dispatching connections to worker processes.
+
+        It is a drop-in replacement of kapacitor.udf.agent.Server, the
+        socket is created on construction and accepter.accept(conn, addr)
+        is called within a worker process for every connection.
+    """
+    def __init__(self, socket_path, accepter, workers,
+                 dispatch=ROUND_ROBIN):
+        """
+        :param socket_path: path of the UDF UNIX socket
+        :type socket_path: str
+        :param accepter: object whose accept(conn, addr) serves a connection
+        :param workers: number of worker processes
+        :type workers: int
+        :param dispatch: round_robin or least_loaded
+        :type dispatch: str
+        """
+        if workers < 1:
+            raise ValueError("workers must be greater than 0")
+        if dispatch not in DISPATCH_POLICIES:
+            raise ValueError("dispatch must be one of {}".format(
+                DISPATCH_POLICIES))
+        self._socket_path = socket_path
+        self._accepter = accepter
+        self._num_workers = workers
+        self._dispatch = dispatch
+        self._workers = []
+        self._next = 0
+        self._stopped = False
+        self._selector = None
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(socket_path)
+        self._listener.listen(128)
+
+    def serve(self):
+        """ Start the workers and dispatch connections until stopped
+        """
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        for index in range(self._num_workers):
+            self._workers.append(self._spawn(index))
+        logger.info("Started %d UDF workers, dispatch: %s",
+                    self._num_workers, self._dispatch)
+
+        try:
+            while not self._stopped:
+                for key, _ in self._selector.select(_REAP_INTERVAL):
+                    if key.fileobj is self._listener:
+                        self._accept()
+                    else:
+                        self._read_worker(key.data)
+                self._reap()
+        finally:
+            self._shutdown()
+
+    def _spawn(self, index):
+        """ Fork a worker process and register its channel
+        """
+        parent_channel, child_channel = socket.socketpair(socket.AF_UNIX,
+                                                          socket.SOCK_STREAM)
+        pid = os.fork()
+        if pid == 0:
+            # Worker process, it must not touch the master's sockets
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            self._listener.close()
+            parent_channel.close()
+            for worker in self._workers:
+                worker.channel.close()
+            status = 0
+            try:
+                _worker_loop(child_channel, self._accepter)
+            except Exception:
+                logger.exception("UDF worker %d failed", index)
+                status = 1
+            finally:
+                os._exit(status)
+
+        child_channel.close()
+        worker = _Worker(index, pid, parent_channel)
+        self._selector.register(parent_channel, selectors.EVENT_READ, worker)
+        logger.info("Started UDF worker %d pid %d", index, pid)
+        return worker
+
+    def _pick(self):
+        """ Select the worker for the next connection
+        """
+        if self._dispatch == LEAST_LOADED:
+            return min(self._workers, key=lambda w: (w.active, w.index))
+        worker = self._workers[self._next % len(self._workers)]
+        self._next += 1
+        return worker
+
+    def _accept(self):
+        conn, _ = self._listener.accept()
+        try:
+            worker = self._pick()
+            send_handle(worker.channel, conn.fileno(), worker.pid)
+            worker.active += 1
+            logger.info("Connection handed over to UDF worker %d "
+                        "(%d active)", worker.index, worker.active)
+        except OSError as err:
+            logger.error("Failed to hand over connection: %s", err)
+        finally:
+            # The worker has its own copy of the descriptor now
+            conn.close()
+
+    def _read_worker(self, worker):
+        try:
+            data = worker.channel.recv(64)
+        except OSError:
+            data = b''
+        if not data:
+            # Channel closed, the worker is gone and will be reaped
+            self._selector.unregister(worker.channel)
+            return
+        worker.active = max(0, worker.active - data.count(_CONN_DONE))
+
+    def _reap(self):
+        """ Replace the workers which have exited
+        """
+        for pos, worker in enumerate(self._workers):
+            try:
+                pid, status = os.waitpid(worker.pid, os.WNOHANG)
+            except ChildProcessError:
+                pid, status = worker.pid, 0
+            if pid == 0:
+                continue
+            logger.warning("UDF worker %d pid %d exited with status %d, "
+                           "restarting it", worker.index, worker.pid, status)
+            if worker.channel in self._selector.get_map():
+                self._selector.unregister(worker.channel)
+            worker.channel.close()
+            if not self._stopped:
+                self._workers[pos] = self._spawn(worker.index)
+
+    def _stop(self, signum, frame):
+        self._stopped = True
+
+    def _shutdown(self):
+        for worker in self._workers:
+            try:
+                os.kill(worker.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for worker in self._workers:
+            try:
+                os.waitpid(worker.pid, 0)
+            except ChildProcessError:
+                pass
+            worker.channel.close()
+        self._listener.close()
+        if os.path.exists(self._socket_path):
+            os.remove(self._socket_path)
+
+
+def _worker_loop(channel, accepter):
+    """ Receive connections from the master and serve each on a thread
+    """
+    lock = threading.Lock()
+    count = 0
+
+    def serve(sock, addr):
+        conn = sock.makefile('rwb')
+        try:
+            accepter.accept(conn, addr)
+        finally:
+            conn.close()
+            sock.close()
+            with lock:
+                channel.sendall(_CONN_DONE)
+
+    while True:
+        try:
+            fd = recv_handle(channel)
+        except (EOFError, OSError):
+            # Master has gone away
+            return
+        sock = socket.socket(fileno=fd)
+        count += 1
+        thread = threading.Thread(target=serve, args=(sock, count))
+        thread.daemon = True
+        thread.start()
+
+
+def create_server(socket_path, accepter):
+    """ Create the UDF socket server configured through the environment.
+
+        UDF_WORKERS sets the number of worker processes and UDF_DISPATCH
+        the dispatch policy, both are set by classifier_startup.py from the
+        task config. A single worker uses the plain Kapacitor Server.
+    """
+    workers = int(os.environ.get("UDF_WORKERS", 1))
+    dispatch = os.environ.get("UDF_DISPATCH", ROUND_ROBIN)
+    if workers <= 1:
+        return Server(socket_path, accepter)
+    return PreforkServer(socket_path, accepter, workers, dispatch)
@@ -21,12 +21,13 @@
 import os
 import sys
 import json
-from kapacitor.udf.agent import Agent, Handler, Server
+from kapacitor.udf.agent import Agent, Handler
 from kapacitor.udf import udf_pb2
 import signal
 import stat
 import logging
 import tempfile
+from prefork_server import create_server
 logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s %(levelname)s:%(name)s: %(message)s')
 logger = logging.getLogger()
@@ -92,7 +93,7 @@ class Accepter(object):
 if __name__ == '__main__':
     tmp_dir = tempfile.gettempdir()
     path = os.path.join(tmp_dir, "point_classifier")
-    server = Server(path, Accepter())
+    server = create_server(path, Accepter())
     os.chmod(path, stat.S_IRWXU | stat.S_IRGRP | stat.S_IXGRP |
              stat.S_IROTH | stat.S_IXOTH)
     logger.info("Started server")
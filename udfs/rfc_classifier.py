@@ -1,6 +1,9 @@
 from kapacitor.udf.agent import Agent, Handler
 import math
 import json
+# sklearn must be patched before the estimators are imported
+from sklearnex import patch_sklearn
+patch_sklearn()
 from sklearn.metrics import classification_report
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
@@ -10,14 +13,50 @@ import os
 from distutils.util import strtobool
 from kapacitor.udf import udf_pb2
 import sys
+import threading
 import pandas as pd
-from sklearnex import patch_sklearn
-patch_sklearn()
+import joblib
+from group_state import GroupStateTable
+from prediction_cache import PredictionCache
 
 logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s %(levelname)s:%(name)s: %(message)s')
 logger = logging.getLogger()
 
+# Emit the predictions at the end of every window of the batch edge
+EMIT_MODE_BATCH = 'batch'
+# Emit the predictions as the points of the stream edge are scored
+EMIT_MODE_STREAM = 'stream'
+
+# Features of the model, in the order of the training set columns
+FEATURE_NAMES = (['Name1', 'Name2', 'Name3', 'Name4', 'Name5', 'ilsts1'] +
+                 ['Name{}'.format(i) for i in range(6, 39)])
+FEATURE_COLUMNS = ['Message.Log.' + name for name in FEATURE_NAMES]
+
+
+class RfcBatchState(object):
+    """
+    Points of a group received within the current batch, or micro-batch
+    in stream mode, not yet emitted
+    """
+    def __init__(self):
+        self.response = None
+        self.clear()
+
+    def clear(self):
+        """
+        Forget the emitted points
+        """
+        self.pred = []
+        self.assetId = []
+        self.batchTS = []
+        self.udf_entry = []
+        self.udf_exit = []
+        self.ts = []
+        self.cache_hit = []
+        # Time at which a pending micro-batch is emitted
+        self.deadline = None
+
 
 class RfcHandler(Handler):
     """
@@ -27,7 +66,48 @@ class RfcHandler(Handler):
         self._agent = agent
         self._history = None
         self._batch = None
+        # Group of the batch in progress, Kapacitor sends the group only
+        # with the begin of a batch
+        self._batch_group = None
         self.profiling_mode = bool(strtobool(os.environ["PROFILING_MODE"]))
+        self.emit_mode = os.environ.get("RFC_EMIT_MODE", EMIT_MODE_BATCH)
+        if self.emit_mode not in (EMIT_MODE_BATCH, EMIT_MODE_STREAM):
+            raise ValueError("RFC_EMIT_MODE must be {} or {}".format(
+                EMIT_MODE_BATCH, EMIT_MODE_STREAM))
+        # Stream mode emits once micro_batch_size points of a group are
+        # scored or micro_batch_delay seconds after the first of them
+        self.micro_batch_size = int(os.environ.get("RFC_MICRO_BATCH_SIZE",
+                                                   1))
+        self.micro_batch_delay = float(os.environ.get(
+            "RFC_MICRO_BATCH_DELAY_MS", 0)) / 1e3
+        if self.micro_batch_size > 1 and self.micro_batch_delay <= 0:
+            raise ValueError("RFC_MICRO_BATCH_DELAY_MS must be set when "
+                             "RFC_MICRO_BATCH_SIZE is greater than 1, else "
+                             "the last points of a group are never emitted")
+        # Micro-batches waiting for their deadline, emitted by the flusher
+        # thread
+        self._lock = threading.RLock()
+        self._flush_cond = threading.Condition(self._lock)
+        self._pending = set()
+        self.cache = PredictionCache.from_env(os.environ, FEATURE_NAMES)
+        self.groups = GroupStateTable.from_env(os.environ, RfcBatchState,
+                                               on_evict=self.evict_group,
+                                               prefix='RFC')
+        if (self.emit_mode == EMIT_MODE_STREAM and
+                self.micro_batch_size > 1) or self.groups.ttl:
+            flusher = threading.Thread(target=self.flush_expired)
+            flusher.daemon = True
+            flusher.start()
+        model_path = os.environ.get("RFC_MODEL_PATH", "")
+        if model_path:
+            # Model exported by tools/rfc_model_tuner.py
+            logging.info("Loading model {}...".format(model_path))
+            self.rfc = joblib.load(model_path)
+            logging.info("model loaded...")
+            self.set_model_version("{}@{}".format(
+                model_path, os.path.getmtime(model_path)))
+            return
+
         logging.info("Training started...")
         training = pd.read_csv('/EII/training_data_sets/Log_rf.csv')
         training = training.sample(frac=1)
@@ -38,9 +118,21 @@ class RfcHandler(Handler):
                                                             test_size=0.2,
                                                             random_state=20,
                                                             stratify=y)
-        self.rfc = RandomForestClassifier(n_estimators=600)
+        n_estimators = int(os.environ.get("RFC_N_ESTIMATORS", 600))
+        self.rfc = RandomForestClassifier(n_estimators=n_estimators)
         self.rfc.fit(X_train, y_train)
         logging.info("training complete...")
+        self.set_model_version("trained@{}".format(time.time()))
+
+    def set_model_version(self, version):
+        """
+        Invalidate the cached predictions of a previous model
+
+        :param version: identifies the model in use
+        :type version: str
+        """
+        if self.cache is not None:
+            self.cache.set_model(version)
 
     def info(self):
         """
@@ -48,7 +140,10 @@ class RfcHandler(Handler):
         want/provide and any options we have.
         """
         response = udf_pb2.Response()
-        response.info.wants = udf_pb2.BATCH
+        if self.emit_mode == EMIT_MODE_STREAM:
+            response.info.wants = udf_pb2.STREAM
+        else:
+            response.info.wants = udf_pb2.BATCH
         response.info.provides = udf_pb2.STREAM
 
         return response
@@ -72,12 +167,10 @@ class RfcHandler(Handler):
         :param begin_req: to start the batch
         :type begin_req: udf_pb2.BeginBatch
         """
-        self.pred = []
-        self.assetId = []
-        self.batchTS = []
-        self.udf_entry = []
-        self.udf_exit = []
-        self.ts = []
+        # Discard whatever is left of an unfinished batch of this group
+        self._batch_group = begin_req.group
+        self.groups.delete(self._batch_group)
+        self.groups.get(self._batch_group)
 
     def point(self, point):
         """
@@ -86,106 +179,62 @@ class RfcHandler(Handler):
         :param point: the body of the point received
         :type point: udf_pb2.Point
         """
+        with self._lock:
+            if self.emit_mode == EMIT_MODE_STREAM:
+                group = point.group
+            else:
+                group = self._batch_group
+            state = self.groups.get(group)
+            self.score(point, state)
+            if self.emit_mode != EMIT_MODE_STREAM:
+                return
+            if len(state.assetId) >= self.micro_batch_size:
+                self.emit(state)
+            elif state.deadline is None:
+                state.deadline = time.monotonic() + self.micro_batch_delay
+                self._pending.add(state)
+                self._flush_cond.notify()
+
+    def score(self, point, state):
+        """
+        Predict the point and keep the result in the group state
+
+        :param point: the body of the point received
+        :type point: udf_pb2.Point
+        :param state: state of the group of the point
+        :type state: RfcBatchState
+        """
         if self.profiling_mode:
             ts1 = (time.time_ns() / 1e6)
-            self.udf_entry.append(ts1)
-            self.ts.append(point.fieldsDouble['ts'])
-        self.response = udf_pb2.Response()
+            state.udf_entry.append(ts1)
+            state.ts.append(point.fieldsDouble['ts'])
+        state.response = udf_pb2.Response()
         jsonObj = json.loads(point.fieldsString['value'])
-        df = pd.DataFrame(columns=['Message.Log.Name1',
-                                   'Message.Log.Name2',
-                                   'Message.Log.Name3',
-                                   'Message.Log.Name4',
-                                   'Message.Log.Name5',
-                                   'Message.Log.ilsts1',
-                                   'Message.Log.Name6',
-                                   'Message.Log.Name7',
-                                   'Message.Log.Name8',
-                                   'Message.Log.Name9',
-                                   'Message.Log.Name10',
-                                   'Message.Log.Name11',
-                                   'Message.Log.Name12',
-                                   'Message.Log.Name13',
-                                   'Message.Log.Name14',
-                                   'Message.Log.Name15',
-                                   'Message.Log.Name16',
-                                   'Message.Log.Name17',
-                                   'Message.Log.Name18',
-                                   'Message.Log.Name19',
-                                   'Message.Log.Name20',
-                                   'Message.Log.Name21',
-                                   'Message.Log.Name22',
-                                   'Message.Log.Name23',
-                                   'Message.Log.Name24',
-                                   'Message.Log.Name25',
-                                   'Message.Log.Name26',
-                                   'Message.Log.Name27',
-                                   'Message.Log.Name28',
-                                   'Message.Log.Name29',
-                                   'Message.Log.Name30',
-                                   'Message.Log.Name31',
-                                   'Message.Log.Name32',
-                                   'Message.Log.Name33',
-                                   'Message.Log.Name34',
-                                   'Message.Log.Name35',
-                                   'Message.Log.Name36',
-                                   'Message.Log.Name37',
-                                   'Message.Log.Name38'])
-
-        df = df.append({
-                    'Message.Log.Name1': jsonObj['Message']['Log']['Name1'],
-                    'Message.Log.Name2': jsonObj['Message']['Log']['Name2'],
-                    'Message.Log.Name3': jsonObj['Message']['Log']['Name3'],
-                    'Message.Log.Name4': jsonObj['Message']['Log']['Name4'],
-                    'Message.Log.Name5': jsonObj['Message']['Log']['Name5'],
-                    'Message.Log.ilsts1': jsonObj['Message']['Log']['ilsts1'],
-                    'Message.Log.Name6': jsonObj['Message']['Log']['Name6'],
-                    'Message.Log.Name7': jsonObj['Message']['Log']['Name7'],
-                    'Message.Log.Name8': jsonObj['Message']['Log']['Name8'],
-                    'Message.Log.Name9': jsonObj['Message']['Log']['Name9'],
-                    'Message.Log.Name10': jsonObj['Message']['Log']['Name10'],
-                    'Message.Log.Name11': jsonObj['Message']['Log']['Name11'],
-                    'Message.Log.Name12': jsonObj['Message']['Log']['Name12'],
-                    'Message.Log.Name13': jsonObj['Message']['Log']['Name13'],
-                    'Message.Log.Name14': jsonObj['Message']['Log']['Name14'],
-                    'Message.Log.Name15': jsonObj['Message']['Log']['Name15'],
-                    'Message.Log.Name16': jsonObj['Message']['Log']['Name16'],
-                    'Message.Log.Name17': jsonObj['Message']['Log']['Name17'],
-                    'Message.Log.Name18': jsonObj['Message']['Log']['Name18'],
-                    'Message.Log.Name19': jsonObj['Message']['Log']['Name19'],
-                    'Message.Log.Name20': jsonObj['Message']['Log']['Name20'],
-                    'Message.Log.Name21': jsonObj['Message']['Log']['Name21'],
-                    'Message.Log.Name22': jsonObj['Message']['Log']['Name22'],
-                    'Message.Log.Name23': jsonObj['Message']['Log']['Name23'],
-                    'Message.Log.Name24': jsonObj['Message']['Log']['Name24'],
-                    'Message.Log.Name25': jsonObj['Message']['Log']['Name25'],
-                    'Message.Log.Name26': jsonObj['Message']['Log']['Name26'],
-                    'Message.Log.Name27': jsonObj['Message']['Log']['Name27'],
-                    'Message.Log.Name28': jsonObj['Message']['Log']['Name28'],
-                    'Message.Log.Name29': jsonObj['Message']['Log']['Name29'],
-                    'Message.Log.Name30': jsonObj['Message']['Log']['Name30'],
-                    'Message.Log.Name31': jsonObj['Message']['Log']['Name31'],
-                    'Message.Log.Name32': jsonObj['Message']['Log']['Name32'],
-                    'Message.Log.Name33': jsonObj['Message']['Log']['Name33'],
-                    'Message.Log.Name34': jsonObj['Message']['Log']['Name34'],
-                    'Message.Log.Name35': jsonObj['Message']['Log']['Name35'],
-                    'Message.Log.Name36': jsonObj['Message']['Log']['Name36'],
-                    'Message.Log.Name37': jsonObj['Message']['Log']['Name37'],
-                    'Message.Log.Name38': jsonObj['Message']['Log']['Name38']},
-                    ignore_index=True)
-
-        predictions = self.rfc.predict(df)
-        self.pred.append(predictions)
+        log = jsonObj['Message']['Log']
+        vector = [log[name] for name in FEATURE_NAMES]
+        predictions = None
+        if self.cache is not None:
+            key = self.cache.key(vector)
+            predictions = self.cache.get(key)
+        state.cache_hit.append(predictions is not None)
+        if predictions is None:
+            start = time.perf_counter()
+            df = pd.DataFrame([vector], columns=FEATURE_COLUMNS)
+            predictions = self.rfc.predict(df)
+            if self.cache is not None:
+                self.cache.put(key, predictions,
+                               time.perf_counter() - start)
+        state.pred.append(predictions)
         if self.profiling_mode:
             ts2 = (time.time_ns() / 1e6)
-            self.udf_exit.append(ts2)
-        self.assetId.append(jsonObj['NameOFLog'])
-        self.batchTS.append(point.time)
+            state.udf_exit.append(ts2)
+        state.assetId.append(jsonObj['NameOFLog'])
+        state.batchTS.append(point.time)
 
-        self.response.point.CopyFrom(point)
-        self.response.point.ClearField('fieldsInt')
-        self.response.point.ClearField('fieldsString')
-        self.response.point.ClearField('fieldsDouble')
+        state.response.point.CopyFrom(point)
+        state.response.point.ClearField('fieldsInt')
+        state.response.point.ClearField('fieldsString')
+        state.response.point.ClearField('fieldsDouble')
 
     def end_batch(self, batch_meta):
         """
@@ -194,19 +243,84 @@ class RfcHandler(Handler):
         :param batch_meta: Create the meta data of the response
         :type batch_meta: udf_pb2.EndBatch
         """
-        for i in range(len(self.assetId)):
-            self.response.point.tags['assetId'] = self.assetId[i]
-            self.response.point.fieldsDouble['prediction'] = self.pred[i]
-            self.response.point.time = self.batchTS[i]
+        state = self.groups.delete(self._batch_group)
+        self._batch_group = None
+        if state is None:
+            return
+        self.emit(state)
+
+    def emit(self, state):
+        """
+        Write the pending predictions of a group to Kapacitor
+
+        :param state: state of the group
+        :type state: RfcBatchState
+        """
+        for i in range(len(state.assetId)):
+            state.response.point.tags['assetId'] = state.assetId[i]
+            state.response.point.fieldsDouble['prediction'] = state.pred[i]
+            state.response.point.time = state.batchTS[i]
             if self.profiling_mode:
-                self.response.point.fieldsInt['ts_kapacitor_udf_entry'] = \
-                    int(self.udf_entry[i])
-                self.response.point.fieldsInt['ts_kapacitor_udf_exit'] = \
-                    int(self.udf_exit[i])
-                self.response.point.fieldsDouble['ts'] = self.ts[i]
-
-            logging.info(self.response)
-            self._agent.write_response(self.response)
+                state.response.point.fieldsInt['ts_kapacitor_udf_entry'] = \
+                    int(state.udf_entry[i])
+                state.response.point.fieldsInt['ts_kapacitor_udf_exit'] = \
+                    int(state.udf_exit[i])
+                state.response.point.fieldsDouble['ts'] = state.ts[i]
+                if self.cache is not None:
+                    state.response.point.fieldsInt['rfc_cache_hit'] = \
+                        int(state.cache_hit[i])
+
+            logging.info(state.response)
+            self._agent.write_response(
+                state.response, self.emit_mode == EMIT_MODE_STREAM)
+
+        state.clear()
+        self._pending.discard(state)
+        if self.profiling_mode:
+            logging.info("Group state: {}".format(self.groups.stats()))
+            if self.cache is not None:
+                logging.info("Prediction cache: {}".format(
+                    self.cache.stats()))
+
+    def flush_expired(self):
+        """
+        Flusher thread emitting the micro-batches whose delay has expired
+        and evicting the idle groups, also when no more points arrive
+        """
+        expire_interval = self.groups.ttl / 2
+        next_expire = time.monotonic()
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                if expire_interval and now >= next_expire:
+                    self.groups.expire()
+                    next_expire = now + expire_interval
+                expired = [state for state in self._pending
+                           if state.deadline <= now]
+                for state in expired:
+                    self.emit(state)
+                deadlines = [state.deadline for state in self._pending]
+                if expire_interval:
+                    deadlines.append(next_expire)
+                if deadlines:
+                    self._flush_cond.wait(max(min(deadlines) - now, 0))
+                else:
+                    self._flush_cond.wait()
+
+    def evict_group(self, group, state):
+        """
+        Called when the state of a group is evicted before its batch ended
+
+        :param group: Kapacitor group ID
+        :type group: str
+        :param state: the evicted state of the group
+        :type state: RfcBatchState
+        """
+        if self.emit_mode == EMIT_MODE_STREAM:
+            self.emit(state)
+            return
+        logging.warning("Evicted group {} dropping {} pending "
+                        "predictions".format(group, len(state.assetId)))
 
     def snapshot(self):
         """